@@ -1,18 +1,35 @@
 import asyncio
 import json
 import os
+import pickle
+import re
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
 
-from aiogram import Bot, Dispatcher, F
+from aiogram import BaseMiddleware, Bot, Dispatcher, F
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, TelegramObject
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 from dotenv import load_dotenv
 
-# Загружаем переменные окружения
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    # orjson необязателен - без него используем стандартный json
+    _json_loads = json.loads
+
+try:
+    import uvloop
+except ImportError:
+    # uvloop недоступен (например, на Windows) - работаем на стандартном цикле asyncio
+    uvloop = None
+
+# Загружаем переменные окружения из .env (уже заданные в окружении значения не перезаписываются)
 load_dotenv()
 
 # Получаем токен из переменных окружения
@@ -21,28 +38,119 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не найден в переменных окружения. Создайте .env файл с BOT_TOKEN=ваш_токен")
 
+# Настройки webhook: если WEBHOOK_BASE_URL не задан, бот работает через long polling
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+
+# Максимум одновременно обрабатываемых обновлений
+MAX_CONCURRENT_UPDATES = 64
+
+# Размер пула соединений с Telegram API: соединения переиспользуются между запросами
+SESSION_CONNECTION_LIMIT = 200
+
 # Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+session = AiohttpSession(limit=SESSION_CONNECTION_LIMIT)
+# HTML-разметка включена по умолчанию для всех сообщений бота
+bot = Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
+# Состояние пользователя целиком передаётся в callback_data, поэтому FSM-хранилище не нужно
+dp = Dispatcher()
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """Ограничивает число одновременно обрабатываемых обновлений, чтобы всплеск нажатий не исчерпал память"""
+    
+    def __init__(self, limit: int):
+        self.limit = limit
+        # Семафор создаётся при первом обновлении, уже внутри работающего цикла событий
+        self.semaphore: Optional[asyncio.Semaphore] = None
+    
+    def get_semaphore(self) -> asyncio.Semaphore:
+        """Возвращает общий семафор, создавая его при первом обращении"""
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.limit)
+        return self.semaphore
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        async with self.get_semaphore():
+            return await handler(event, data)
+
+concurrency_limit = ConcurrencyLimitMiddleware(MAX_CONCURRENT_UPDATES)
+dp.update.outer_middleware(concurrency_limit)
 
 # Путь к файлу с вопросами
 QUESTIONS_FILE = Path(__file__).parent.parent / "data" / "QUESTIONS_BASE.json"
 
+# Шаблоны callback_data: разбираем строку за один проход вместо split
+_SELECT_Q_RE = re.compile(r"select_q_(\d+)")
+_ANSWER_RE = re.compile(r"answer_(\d+)_(\d+)_(continuous|select)")
+_NEXT_QUESTION_RE = re.compile(r"next_question_(\d+)_(continuous|select)")
+
+# Кэш уже разобранных вопросов рядом с JSON файлом
+QUESTIONS_CACHE_FILE = QUESTIONS_FILE.with_suffix(".pkl")
+
 # Загружаем вопросы из JSON
 def load_questions() -> List[Dict]:
-    """Загружает вопросы из JSON файла"""
-    with open(QUESTIONS_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
-
-# Состояния FSM
-class TestStates(StatesGroup):
-    waiting_for_answer = State()
-    question_selection = State()
+    """Загружает вопросы из кэша, а при его устаревании - из JSON файла"""
+    src_stat = QUESTIONS_FILE.stat()
+    cache_key = (src_stat.st_mtime_ns, src_stat.st_size)
+    
+    if QUESTIONS_CACHE_FILE.exists():
+        try:
+            cached_key, cached_data = pickle.loads(QUESTIONS_CACHE_FILE.read_bytes())
+            if cached_key == cache_key:
+                return cached_data
+        except Exception:
+            # Повреждённый или несовместимый кэш просто пересобираем
+            pass
+    
+    data = _json_loads(QUESTIONS_FILE.read_bytes())
+    try:
+        QUESTIONS_CACHE_FILE.write_bytes(pickle.dumps((cache_key, data), protocol=pickle.HIGHEST_PROTOCOL))
+    except OSError as e:
+        print(f"Не удалось сохранить кэш вопросов: {e}")
+    return data
 
 # Глобальная переменная для хранения вопросов
 questions_data = load_questions()
 
+# Таблица ответов: ANSWER_TABLE[номер вопроса] = (варианты ответов, правильный ответ)
+ANSWER_TABLE: List[Optional[Tuple[Tuple[str, ...], str]]] = [None] + [
+    (tuple(q.get("answers", [])), q.get("correct_answer", "")) for q in questions_data
+]
+
+# Telegram ограничивает текст кнопки 64 символами в кодировке UTF-16
+BUTTON_TEXT_LIMIT = 64
+
+def _utf16_len(text: str) -> int:
+    """Длина строки в кодовых единицах UTF-16 (так считает Telegram)"""
+    return len(text.encode("utf-16-le")) // 2
+
+def truncate_button_text(text: str) -> str:
+    """Обрезает текст кнопки по лимиту Telegram, не разрывая символы"""
+    if _utf16_len(text) <= BUTTON_TEXT_LIMIT:
+        return text
+    # Оставляем место под "..." и отрезаем целые символы, пока текст не поместится
+    budget = BUTTON_TEXT_LIMIT - 3
+    cut = 0
+    for char in text:
+        budget -= 2 if ord(char) > 0xFFFF else 1
+        if budget < 0:
+            break
+        cut += 1
+    return text[:cut] + "..."
+
+# Тексты кнопок ответов: BUTTON_TEXT_TABLE[номер вопроса] = уже обрезанные варианты ответов
+BUTTON_TEXT_TABLE: List[Optional[Tuple[str, ...]]] = [None] + [
+    tuple(truncate_button_text(answer) for answer in answers) for answers, _ in ANSWER_TABLE[1:]
+]
+
 def get_question_by_number(question_num: int) -> Optional[Dict]:
     """Получает вопрос по номеру (1-60)"""
     if 1 <= question_num <= len(questions_data):
@@ -53,20 +161,12 @@ def get_question_key(question_num: int) -> str:
     """Возвращает ключ вопроса (question1, question2, ...)"""
     return f"question{question_num}"
 
-def create_answer_keyboard(answers: List[str], question_num: int, mode: str) -> InlineKeyboardMarkup:
+def create_answer_keyboard(question_num: int, mode: str) -> InlineKeyboardMarkup:
     """Создает клавиатуру с вариантами ответов"""
     buttons = []
-    for idx, answer in enumerate(answers):
+    # Тексты кнопок обрезаны заранее, полный текст уже виден в сообщении с вопросом выше
+    for idx, button_text in enumerate(BUTTON_TEXT_TABLE[question_num]):
         callback_data = f"answer_{question_num}_{idx}_{mode}"
-        # Telegram ограничивает текст кнопки до 64 символов
-        # Показываем максимально возможный текст на кнопке
-        # Полный текст уже виден в сообщении с вопросом выше
-        if len(answer) <= 64:
-            # Если текст помещается - показываем полностью
-            button_text = answer
-        else:
-            # Если текст длинный - показываем начало (максимум 64 символа)
-            button_text = answer[:61] + "..."
         buttons.append([InlineKeyboardButton(text=button_text, callback_data=callback_data)])
     
     # Добавляем кнопку возврата в меню
@@ -74,137 +174,208 @@ def create_answer_keyboard(answers: List[str], question_num: int, mode: str) ->
     
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+def render_question_text(question_num: int, question_text: str, answers: List[str]) -> str:
+    """Формирует текст сообщения с вопросом и полными вариантами ответов"""
+    answers_block = "\n\n".join(answers)
+    return (
+        f"❓ <b>Вопрос {question_num}:</b>\n\n{question_text}\n\n"
+        f"<b>Варианты ответов:</b>\n\n{answers_block}\n"
+    )
+
+def build_rendered_questions() -> Tuple[Dict[int, str], Dict[Tuple[int, str], InlineKeyboardMarkup]]:
+    """Заранее формирует тексты и клавиатуры всех вопросов для обоих режимов"""
+    rendered_text = {}
+    rendered_kb = {}
+    for question_num in range(1, len(questions_data) + 1):
+        question_data = get_question_by_number(question_num)
+        question_text = question_data.get(get_question_key(question_num), "")
+        answers = question_data.get("answers", [])
+        if not question_text or not answers:
+            continue
+        rendered_text[question_num] = render_question_text(question_num, question_text, answers)
+        for mode in ("continuous", "select"):
+            rendered_kb[(question_num, mode)] = create_answer_keyboard(question_num, mode)
+    return rendered_text, rendered_kb
+
+# Тексты и клавиатуры вопросов не меняются, поэтому собираем их один раз при запуске
+RENDERED_TEXT, RENDERED_KB = build_rendered_questions()
+
 def create_question_selection_keyboard() -> InlineKeyboardMarkup:
     """Создает клавиатуру для выбора вопроса (1-60)"""
-    buttons = []
     # Создаем кнопки по 5 в ряд
-    for i in range(0, 60, 5):
-        row = []
-        for j in range(5):
-            num = i + j + 1
-            if num <= 60:
-                row.append(InlineKeyboardButton(text=str(num), callback_data=f"select_q_{num}"))
-        buttons.append(row)
-    
-    buttons.append([InlineKeyboardButton(text="🔙 Вернуться в меню", callback_data="back_to_menu")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
-
-def create_main_menu_keyboard() -> InlineKeyboardMarkup:
-    """Создает главное меню с выбором режима"""
     buttons = [
-        [InlineKeyboardButton(text="📝 Сплошная сессия", callback_data="mode_continuous")],
-        [InlineKeyboardButton(text="🔍 Выбор вопроса", callback_data="mode_select")]
+        [InlineKeyboardButton(text=str(num), callback_data=f"select_q_{num}") for num in range(i, i + 5)]
+        for i in range(1, 61, 5)
     ]
+    buttons.append([InlineKeyboardButton(text="🔙 Вернуться в меню", callback_data="back_to_menu")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+# Лимит Telegram - 4096 символов, но оставляем запас для форматирования
+MAX_MESSAGE_LENGTH = 4000
+
+# Ответ на правильный вариант - короткая константа, разбивать её не нужно
+CORRECT_MSG = "✅ Молодец! Правильный ответ!"
+
+def build_wrong_texts() -> List[Optional[Tuple[str, ...]]]:
+    """Заранее формирует ответ на ошибку для каждого вопроса, разбивая слишком длинные на части"""
+    wrong_texts = [None]
+    for question_num, (_, correct_answer) in enumerate(ANSWER_TABLE[1:], start=1):
+        # Используем полный текст правильного ответа без обрезания
+        wrong = f"❌ Ошибочка!\n\n<b>Правильный ответ:</b>\n\n{correct_answer}"
+        if len(wrong) > MAX_MESSAGE_LENGTH:
+            print(f"Ответ на вопрос {question_num} длиннее {MAX_MESSAGE_LENGTH} символов и будет отправлен частями")
+        parts = tuple(wrong[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(wrong), MAX_MESSAGE_LENGTH))
+        wrong_texts.append(parts)
+    return wrong_texts
+
+# Ответ на ошибку: WRONG_TEXT[номер вопроса] = части сообщения (обычно ровно одна)
+WRONG_TEXT = build_wrong_texts()
+
+# Статичные клавиатуры создаются один раз и переиспользуются всеми обработчиками
+# Клавиатура выбора вопроса (1-60)
+SELECT_KB = create_question_selection_keyboard()
+
+# Главное меню с выбором режима
+MAIN_MENU_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📝 Сплошная сессия", callback_data="mode_continuous")],
+    [InlineKeyboardButton(text="🔍 Выбор вопроса", callback_data="mode_select")]
+])
+
+# Клавиатура приветствия для /start
+START_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🚀 Начать решать", callback_data="start_test")]
+])
+
+# Клавиатура с единственной кнопкой возврата в меню
+BACK_TO_MENU_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🔙 Вернуться в меню", callback_data="back_to_menu")]
+])
+
+# Клавиатура после ответа в режиме выбора вопроса
+SELECT_RESULT_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🔄 Выбрать другой вопрос", callback_data="mode_select")],
+    [InlineKeyboardButton(text="🔙 Вернуться в меню", callback_data="back_to_menu")]
+])
+
+async def _edit(callback: CallbackQuery, text: str, keyboard: Optional[InlineKeyboardMarkup] = None):
+    """Редактирует сообщение с кнопками (parse_mode задан по умолчанию для бота)"""
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest as e:
+        # Повторное нажатие той же кнопки не меняет сообщение - это не ошибка
+        if "message is not modified" not in str(e):
+            raise
+
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
     """Обработчик команды /start"""
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🚀 Начать решать", callback_data="start_test")]
-    ])
     await message.answer(
         "👋 Добро пожаловать в бота для подготовки к экзамену!\n\n"
         "Выберите действие:",
-        reply_markup=keyboard
+        reply_markup=START_KB
     )
 
 @dp.callback_query(F.data == "start_test")
 async def start_test(callback: CallbackQuery):
     """Обработчик кнопки 'Начать решать'"""
-    await callback.message.edit_text(
-        "Выберите режим тестирования:",
-        reply_markup=create_main_menu_keyboard()
-    )
+    await _edit(callback, "Выберите режим тестирования:", MAIN_MENU_KB)
     await callback.answer()
 
 @dp.callback_query(F.data == "back_to_menu")
-async def back_to_menu(callback: CallbackQuery, state: FSMContext):
+async def back_to_menu(callback: CallbackQuery):
     """Обработчик кнопки возврата в меню"""
-    await state.clear()
-    await callback.message.edit_text(
-        "Выберите режим тестирования:",
-        reply_markup=create_main_menu_keyboard()
-    )
+    await _edit(callback, "Выберите режим тестирования:", MAIN_MENU_KB)
     await callback.answer()
 
 @dp.callback_query(F.data == "mode_continuous")
-async def mode_continuous(callback: CallbackQuery, state: FSMContext):
+async def mode_continuous(callback: CallbackQuery):
     """Обработчик выбора режима 'Сплошная сессия'"""
-    await state.update_data(current_question=1, mode="continuous")
-    await show_question(callback, 1, "continuous", state)
+    await show_question(callback, 1, "continuous")
     await callback.answer()
 
 @dp.callback_query(F.data == "mode_select")
-async def mode_select(callback: CallbackQuery, state: FSMContext):
+async def mode_select(callback: CallbackQuery):
     """Обработчик выбора режима 'Выбор вопроса'"""
-    await callback.message.edit_text(
-        "Выберите номер вопроса (1-60):",
-        reply_markup=create_question_selection_keyboard()
-    )
+    await _edit(callback, "Выберите номер вопроса (1-60):", SELECT_KB)
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("select_q_"))
-async def select_question(callback: CallbackQuery, state: FSMContext):
+async def select_question(callback: CallbackQuery):
     """Обработчик выбора конкретного вопроса"""
-    question_num = int(callback.data.split("_")[-1])
-    await state.update_data(current_question=question_num, mode="select")
-    await show_question(callback, question_num, "select", state)
+    match = _SELECT_Q_RE.fullmatch(callback.data)
+    if not match:
+        await callback.answer("❌ Ошибка!")
+        return
+    question_num = int(match[1])
+    await show_question(callback, question_num, "select")
     await callback.answer()
 
-async def show_question(callback: CallbackQuery, question_num: int, mode: str, state: FSMContext):
+async def show_question(callback: CallbackQuery, question_num: int, mode: str):
     """Показывает вопрос с вариантами ответов"""
-    question_data = get_question_by_number(question_num)
-    
-    if not question_data:
-        await callback.message.edit_text("❌ Вопрос не найден!")
+    if not 1 <= question_num <= len(questions_data):
+        await _edit(callback, "❌ Вопрос не найден!")
         return
     
-    question_key = get_question_key(question_num)
-    question_text = question_data.get(question_key, "")
-    answers = question_data.get("answers", [])
-    
-    if not question_text or not answers:
-        await callback.message.edit_text("❌ Ошибка загрузки вопроса!")
+    text = RENDERED_TEXT.get(question_num)
+    if text is None:
+        await _edit(callback, "❌ Ошибка загрузки вопроса!")
         return
     
-    # Формируем текст сообщения с полными вариантами ответов
-    text = f"❓ <b>Вопрос {question_num}:</b>\n\n{question_text}\n\n"
-    text += "<b>Варианты ответов:</b>\n"
-    for answer in answers:
-        text += f"\n{answer}\n"
-    
-    keyboard = create_answer_keyboard(answers, question_num, mode)
-    
-    await callback.message.edit_text(
-        text,
-        reply_markup=keyboard,
-        parse_mode="HTML"
-    )
+    await _edit(callback, text, RENDERED_KB[(question_num, mode)])
+
+# Ссылки на фоновые задачи, чтобы сборщик мусора не удалил их до завершения
+_background_tasks: Set[asyncio.Task] = set()
+
+async def _delayed_next(callback: CallbackQuery, next_question: int, mode: str):
+    """После небольшой паузы показывает следующий вопрос или поздравление в конце теста"""
+    await asyncio.sleep(1.5)
+    # Задача работает вне обработчика, поэтому сама занимает место в общем лимите
+    # и сама сообщает об ошибках - middleware aiogram их уже не увидит
+    try:
+        async with concurrency_limit.get_semaphore():
+            if next_question <= 60:
+                await show_question(callback, next_question, mode)
+            else:
+                # Все вопросы пройдены
+                await _edit(
+                    callback,
+                    "🎉 Поздравляем! Вы прошли все 60 вопросов!\n\n"
+                    "Хотите начать заново?",
+                    BACK_TO_MENU_KB
+                )
+    except Exception as e:
+        print(f"Ошибка при показе вопроса {next_question}: {e}")
+
+async def _reply_wrong(callback: CallbackQuery, question_num: int, keyboard: InlineKeyboardMarkup):
+    """Показывает правильный ответ, при необходимости досылая вторую часть отдельным сообщением"""
+    first_part, *other_parts = WRONG_TEXT[question_num]
+    await _edit(callback, first_part, keyboard)
+    # Остальные части (если ответ не поместился) отправляем новыми сообщениями
+    for part in other_parts:
+        await callback.message.answer(part)
 
 @dp.callback_query(F.data.startswith("answer_"))
-async def handle_answer(callback: CallbackQuery, state: FSMContext):
+async def handle_answer(callback: CallbackQuery):
     """Обработчик выбора ответа"""
-    parts = callback.data.split("_")
-    question_num = int(parts[1])
-    answer_idx = int(parts[2])
-    mode = parts[3]
-    
-    question_data = get_question_by_number(question_num)
+    match = _ANSWER_RE.fullmatch(callback.data)
+    if not match:
+        await callback.answer("❌ Ошибка!")
+        return
+    question_num = int(match[1])
+    answer_idx = int(match[2])
+    mode = match[3]
     
-    if not question_data:
+    if not 1 <= question_num < len(ANSWER_TABLE):
         await callback.answer("❌ Ошибка!")
         return
     
-    answers = question_data.get("answers", [])
-    correct_answer = question_data.get("correct_answer", "")
+    answers, correct_answer = ANSWER_TABLE[question_num]
     
     if answer_idx >= len(answers):
         await callback.answer("❌ Ошибка!")
         return
     
-    selected_answer = answers[answer_idx]
-    is_correct = selected_answer == correct_answer
+    is_correct = answers[answer_idx] == correct_answer
     
     await callback.answer()
     
@@ -213,33 +384,14 @@ async def handle_answer(callback: CallbackQuery, state: FSMContext):
         # Режим сплошной сессии
         if is_correct:
             # Правильный ответ - автоматически переходим к следующему
-            response_text = "✅ Молодец! Правильный ответ!"
-            await callback.message.edit_text(
-                response_text,
-                parse_mode="HTML"
-            )
+            await _edit(callback, CORRECT_MSG)
             
-            next_question = question_num + 1
-            if next_question <= 60:
-                await asyncio.sleep(1.5)  # Небольшая пауза перед следующим вопросом
-                await state.update_data(current_question=next_question)
-                await show_question(callback, next_question, mode, state)
-            else:
-                # Все вопросы пройдены
-                await asyncio.sleep(1.5)
-                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="🔙 Вернуться в меню", callback_data="back_to_menu")]
-                ])
-                await callback.message.edit_text(
-                    "🎉 Поздравляем! Вы прошли все 60 вопросов!\n\n"
-                    "Хотите начать заново?",
-                    reply_markup=keyboard
-                )
+            # Пауза перед следующим вопросом выполняется в фоне, чтобы не держать обработчик
+            task = asyncio.create_task(_delayed_next(callback, question_num + 1, mode))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
         else:
             # Неправильный ответ - показываем правильный ответ с кнопками
-            # Используем полный текст правильного ответа без обрезания
-            response_text = f"❌ Ошибочка!\n\n<b>Правильный ответ:</b>\n\n{correct_answer}"
-            
             next_question = question_num + 1
             buttons = []
             
@@ -255,87 +407,62 @@ async def handle_answer(callback: CallbackQuery, state: FSMContext):
             )])
             
             keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-            
-            # Если сообщение слишком длинное, разбиваем на части
-            # Лимит Telegram - 4096 символов, но оставляем запас для форматирования
-            max_length = 4000
-            if len(response_text) > max_length:
-                # Разбиваем на части
-                part1 = response_text[:max_length]
-                part2 = response_text[max_length:]
-                await callback.message.edit_text(
-                    part1,
-                    reply_markup=keyboard,
-                    parse_mode="HTML"
-                )
-                # Отправляем вторую часть как новое сообщение
-                await callback.message.answer(
-                    part2,
-                    parse_mode="HTML"
-                )
-            else:
-                await callback.message.edit_text(
-                    response_text,
-                    reply_markup=keyboard,
-                    parse_mode="HTML"
-                )
+            await _reply_wrong(callback, question_num, keyboard)
     else:
         # Режим выбора вопроса
         if is_correct:
-            response_text = "✅ Молодец! Правильный ответ!"
+            await _edit(callback, CORRECT_MSG, SELECT_RESULT_KB)
         else:
-            # Используем полный текст правильного ответа без обрезания
-            response_text = f"❌ Ошибочка!\n\n<b>Правильный ответ:</b>\n\n{correct_answer}"
-        
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔄 Выбрать другой вопрос", callback_data="mode_select")],
-            [InlineKeyboardButton(text="🔙 Вернуться в меню", callback_data="back_to_menu")]
-        ])
-        
-        # Если сообщение слишком длинное, разбиваем на части
-        max_length = 4000
-        if len(response_text) > max_length:
-            # Разбиваем на части
-            part1 = response_text[:max_length]
-            part2 = response_text[max_length:]
-            await callback.message.edit_text(
-                part1,
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-            # Отправляем вторую часть как новое сообщение
-            await callback.message.answer(
-                part2,
-                parse_mode="HTML"
-            )
-        else:
-            await callback.message.edit_text(
-                response_text,
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
+            await _reply_wrong(callback, question_num, SELECT_RESULT_KB)
 
 @dp.callback_query(F.data.startswith("next_question_"))
-async def handle_next_question(callback: CallbackQuery, state: FSMContext):
+async def handle_next_question(callback: CallbackQuery):
     """Обработчик кнопки 'Следующий вопрос' после неправильного ответа"""
-    parts = callback.data.split("_")
-    next_question = int(parts[2])
-    mode = parts[3]
+    match = _NEXT_QUESTION_RE.fullmatch(callback.data)
+    if not match:
+        await callback.answer("❌ Ошибка!")
+        return
+    next_question = int(match[1])
+    mode = match[2]
     
-    await state.update_data(current_question=next_question)
-    await show_question(callback, next_question, mode, state)
+    await show_question(callback, next_question, mode)
     await callback.answer()
 
+async def run_webhook():
+    """Запускает aiohttp-сервер, на который Telegram присылает обновления"""
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host=WEBAPP_HOST, port=WEBAPP_PORT).start()
+        await bot.set_webhook(WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+        print(f"Webhook слушает {WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}")
+        # Сервер работает до отмены задачи (Ctrl+C)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
 async def main():
     """Главная функция запуска бота"""
     print("Бот запущен...")
     print(f"Загружено вопросов: {len(questions_data)}")
     try:
-        await dp.start_polling(bot)
+        if WEBHOOK_BASE_URL:
+            await run_webhook()
+        else:
+            # getUpdates не работает, пока установлен webhook
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
     except Exception as e:
         print(f"Ошибка при запуске бота: {e}")
         raise
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
 